@@ -6,17 +6,48 @@ Author: [Natefrog]
 Created: 2025-02-07
 """
 import asyncio
-import json
+import atexit
+import orjson
 import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 import paho.mqtt.client as mqtt
 import numpy as np
 from dataclasses import dataclass, asdict
 import pandas as pd
 from collections import deque
 import threading
-from concurrent.futures import ThreadPoolExecutor
+from _kernels import make_z
+
+_REQUIRED_FIELDS = frozenset(('timestamp', 'value', 'quality_score'))
+_REQUIRED_FIELDS_MSG = f"Missing required fields: {sorted(_REQUIRED_FIELDS)}"
+
+_log_listener: Optional[QueueListener] = None
+
+def configure_logging(level: int = logging.INFO) -> QueueListener:
+    """Route root log records through a queue so file and console I/O run on a background thread.
+
+    Handlers are installed once per process; later calls only update the level.
+    """
+    global _log_listener
+    root = logging.getLogger()
+    if _log_listener is None:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        file_handler = logging.FileHandler(f'water_meter_test_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log')
+        stream_handler = logging.StreamHandler()
+        file_handler.setFormatter(formatter)
+        stream_handler.setFormatter(formatter)
+        
+        log_queue = queue.SimpleQueue()
+        root.addHandler(QueueHandler(log_queue))
+        _log_listener = QueueListener(log_queue, file_handler, stream_handler)
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
+    root.setLevel(level)
+    return _log_listener
 
 @dataclass
 class SensorConfig:
@@ -24,32 +55,62 @@ class SensorConfig:
     z_score_threshold: float = 2.5
     quality_threshold: float = 0.8
     window_size: int = 600  # 10 minutes in seconds
-    buffer_size: int = 1000
+    buffer_size: int = 1024  # power of two so ring indices wrap with a mask
     data_topic: str = "sensor/water_meter_001/data"
+    batch_topic: str = "sensor/water_meter_001/data_batch"
     status_topic: str = "sensor/water_meter_001/status"
     alert_topic: str = "sensor/water_meter_001/alerts"
 
+    def __post_init__(self):
+        if self.buffer_size <= 0 or self.buffer_size & (self.buffer_size - 1):
+            raise ValueError(f"buffer_size must be a power of two, got {self.buffer_size}")
+
+class StripedCounter:
+    """Counter with one cell per thread, summed lazily on read."""
+    def __init__(self):
+        self._cells: Dict[int, int] = {}
+
+    def increment(self, n: int = 1):
+        # Each thread only ever writes its own cell
+        tid = threading.get_ident()
+        self._cells[tid] = self._cells.get(tid, 0) + n
+
+    @property
+    def value(self) -> int:
+        return sum(list(self._cells.values()))
+
 class PerformanceMonitor:
     def __init__(self):
         self.processing_times = deque(maxlen=1000)
         self.buffer_sizes = deque(maxlen=1000)
-        self.error_count = 0
-        self.processed_count = 0
+        self._errors = StripedCounter()
+        self._processed = StripedCounter()
         self.last_report_time = datetime.now()
         self.report_interval = 60  # seconds
 
     def add_processing_time(self, time_ms: float):
         self.processing_times.append(time_ms)
-        self.processed_count += 1
+        self._processed.increment()
 
     def add_buffer_size(self, size: int):
         self.buffer_sizes.append(size)
 
     def increment_error(self):
-        self.error_count += 1
+        self._errors.increment()
+
+    @property
+    def error_count(self) -> int:
+        return self._errors.value
+
+    @property
+    def processed_count(self) -> int:
+        return self._processed.value
 
     def get_stats(self) -> Dict:
         now = datetime.now()
+        # Read each counter once so the report is self-consistent
+        processed_count = self.processed_count
+        error_count = self.error_count
         if len(self.processing_times) > 0:
             avg_processing = np.mean(self.processing_times)
             max_processing = max(self.processing_times)
@@ -59,21 +120,31 @@ class PerformanceMonitor:
 
         return {
             "timestamp": now.isoformat(),
-            "processed_messages": self.processed_count,
-            "error_count": self.error_count,
+            "processed_messages": processed_count,
+            "error_count": error_count,
             "avg_processing_time_ms": avg_processing,
             "max_processing_time_ms": max_processing,
             "p95_processing_time_ms": p95_processing,
             "current_buffer_size": len(self.buffer_sizes),
-            "error_rate": self.error_count / max(self.processed_count, 1)
+            "error_rate": error_count / max(processed_count, 1)
         }
 
 class WaterMeterTestRunner:
     def __init__(self, config: SensorConfig):
         self.config = config
         self.monitor = PerformanceMonitor()
-        self.data_buffer = deque(maxlen=config.buffer_size)
+        # Ring buffer with running moments so the z-score is O(1) per message
+        self.ring = np.empty(config.buffer_size, dtype=np.float64)
+        self.head = 0
+        self.count = 0
+        self.sum_x = 0.0
+        self.sum_x2 = 0.0
+        self._push_and_score = make_z(config.buffer_size)
         self.running = False
+        # Event loop and queue that paho's network thread hands payloads to
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._monitor_handle: Optional[asyncio.TimerHandle] = None
         self.logger = logging.getLogger("WaterMeterTest")
         self.setup_logging()
         
@@ -83,24 +154,15 @@ class WaterMeterTestRunner:
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
         
-        # Thread pool for async processing
-        self.executor = ThreadPoolExecutor(max_workers=4)
-        
     def setup_logging(self):
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(f'water_meter_test_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'),
-                logging.StreamHandler()
-            ]
-        )
+        configure_logging()
 
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             self.logger.info("Connected to MQTT broker")
             client.subscribe([
                 (self.config.data_topic, 1),
+                (self.config.batch_topic, 1),
                 (self.config.status_topic, 1)
             ])
         else:
@@ -112,24 +174,41 @@ class WaterMeterTestRunner:
             self.logger.info("Attempting to reconnect...")
             client.reconnect()
 
-    async def _process_message(self, message) -> Optional[Dict]:
-        start_time = datetime.now()
+    def _process_message(self, raw_payload: Union[bytes, memoryview]) -> Union[Dict, List[Dict], None]:
+        try:
+            payload = orjson.loads(raw_payload)
+        except ValueError as e:
+            self.logger.error(f"Error decoding message: {str(e)}")
+            self.monitor.increment_error()
+            return None
+        
+        # Batched publishes carry a JSON array of records; return the ones
+        # that processed, or None when none did, matching a single record
+        if isinstance(payload, list):
+            processed = [record for record in payload if self._process_record(record) is not None]
+            return processed or None
+        return self._process_record(payload)
+
+    def _process_record(self, payload: Dict) -> Optional[Dict]:
+        t0 = time.perf_counter_ns()
         try:
-            payload = json.loads(message.payload)
-            
             # Validate message structure
-            required_fields = ['timestamp', 'value', 'quality_score']
-            if not all(field in payload for field in required_fields):
-                raise ValueError(f"Missing required fields: {required_fields}")
+            if not _REQUIRED_FIELDS <= payload.keys():
+                raise ValueError(_REQUIRED_FIELDS_MSG)
+            
+            # Drop missing/corrupt values before they reach the ring buffer
+            value = payload['value']
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value != value:
+                self.monitor.increment_error()
+                return None
             
             # Process data
-            self.data_buffer.append(payload['value'])
-            if len(self.data_buffer) >= 2:
-                z_score = self._calculate_z_score(payload['value'])
-                
+            value = float(value)
+            z_score = self._push_value(value)
+            if self.count >= 2:
                 # Check thresholds
                 if abs(z_score) > self.config.z_score_threshold:
-                    await self._publish_alert({
+                    self._publish_alert({
                         "type": "anomaly",
                         "z_score": z_score,
                         "value": payload['value'],
@@ -137,14 +216,14 @@ class WaterMeterTestRunner:
                     })
                 
                 if payload['quality_score'] < self.config.quality_threshold:
-                    await self._publish_alert({
+                    self._publish_alert({
                         "type": "quality",
                         "score": payload['quality_score'],
                         "threshold": self.config.quality_threshold,
                         "timestamp": payload['timestamp']
                     })
             
-            processing_time = (datetime.now() - start_time).total_seconds() * 1000
+            processing_time = (time.perf_counter_ns() - t0) * 1e-6
             self.monitor.add_processing_time(processing_time)
             return payload
             
@@ -153,57 +232,80 @@ class WaterMeterTestRunner:
             self.monitor.increment_error()
             return None
 
-    def _calculate_z_score(self, value: float) -> float:
-        if len(self.data_buffer) < 2:
-            return 0
-        return (value - np.mean(self.data_buffer)) / np.std(self.data_buffer)
+    def _push_value(self, value: float) -> float:
+        """Write a value into the ring buffer and return its z-score against the window."""
+        self.head, self.count, self.sum_x, self.sum_x2, z_score = self._push_and_score(
+            self.ring, self.head, self.count, self.sum_x, self.sum_x2, value
+        )
+        return z_score
 
-    async def _publish_alert(self, alert_data: Dict):
+    def _publish_alert(self, alert_data: Dict):
         try:
             self.client.publish(
                 self.config.alert_topic,
-                json.dumps(alert_data),
+                orjson.dumps(alert_data),
                 qos=1
             )
         except Exception as e:
             self.logger.error(f"Error publishing alert: {str(e)}")
 
     def _on_message(self, client, userdata, message):
-        asyncio.run(self._process_message(message))
+        # Runs on paho's network thread; hand off to the event loop
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, message.payload)
+
+    async def _consume_messages(self):
+        while True:
+            payload = await self._queue.get()
+            self._process_message(payload)
         
     async def start_test(self, duration_seconds: int):
         self.running = True
         self.logger.info(f"Starting test for {duration_seconds} seconds")
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        consumer_task = asyncio.create_task(self._consume_messages())
         
         try:
             self.client.connect("localhost", 1883, 60)
             self.client.loop_start()
             
             # Start performance monitoring
-            monitor_task = asyncio.create_task(self._monitor_performance())
+            self._monitor_performance()
             
             # Wait for test duration
             await asyncio.sleep(duration_seconds)
             
             self.running = False
-            await monitor_task
             
             # Generate final report
             final_stats = self.monitor.get_stats()
-            self.logger.info(f"Final test statistics: {json.dumps(final_stats, indent=2)}")
+            self.logger.info(
+                "Final test statistics: "
+                + orjson.dumps(final_stats, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_INDENT_2).decode()
+            )
             
         except Exception as e:
             self.logger.error(f"Error during test: {str(e)}")
         finally:
             self.client.loop_stop()
             self.client.disconnect()
-            self.executor.shutdown()
+            consumer_task.cancel()
+            if self._monitor_handle is not None:
+                self._monitor_handle.cancel()
 
-    async def _monitor_performance(self):
-        while self.running:
+    def _monitor_performance(self):
+        """Log stats and reschedule itself every report_interval seconds."""
+        if not self.running:
+            return
+        try:
             stats = self.monitor.get_stats()
-            self.logger.info(f"Performance stats: {json.dumps(stats, indent=2)}")
-            await asyncio.sleep(self.monitor.report_interval)
+            self.logger.info(
+                "Performance stats: " + orjson.dumps(stats, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+            )
+        except Exception as e:
+            self.logger.error(f"Error reporting performance: {str(e)}")
+        finally:
+            self._monitor_handle = self.loop.call_later(self.monitor.report_interval, self._monitor_performance)
 
 if __name__ == "__main__":
     # Initialize with configuration
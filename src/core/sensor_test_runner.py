@@ -1,13 +1,15 @@
 import paho.mqtt.client as mqtt
 import numpy as np
 from datetime import datetime
-import json
+import orjson
 import asyncio
+import math
 from typing import Dict, List, Optional
 import logging
 from dataclasses import dataclass
+from collections import deque
 import pandas as pd
-from scipy import stats
+from _kernels import stats4
 
 @dataclass
 class SensorReading:
@@ -17,27 +19,51 @@ class SensorReading:
     quality_score: float
     metadata: Dict
 
+class RingSoA:
+    """Structure-of-arrays buffer holding one sensor's pending readings."""
+    def __init__(self, capacity: int):
+        self.values = np.empty(capacity, dtype=np.float64)
+        # Timestamps stay as received (epoch ns ints or ISO strings)
+        self.ts = np.empty(capacity, dtype=object)
+        self.q = np.empty(capacity, dtype=np.float32)
+        self.idx = 0
+
 class SensorValidator:
     def __init__(self, config: Dict):
         self.moving_window: int = config.get('moving_window', 100)
         self.z_score_threshold: float = config.get('z_score_threshold', 3.0)
         self.min_quality_score: float = config.get('min_quality_score', 0.7)
-        self.history: Dict[str, List[float]] = {}
+        self.history: Dict[str, deque] = {}
+        # Running [sum, sum of squares] of each sensor's history window
+        self.moments: Dict[str, List[float]] = {}
         
     def validate_reading(self, reading: SensorReading) -> tuple[bool, str]:
         """Validates sensor reading using multiple criteria."""
+        # Non-finite values would poison the running moments for good
+        value = float(reading.value)
+        if not math.isfinite(value):
+            return False, f"Non-finite value {reading.value!r}"
+        
         if reading.sensor_id not in self.history:
-            self.history[reading.sensor_id] = []
+            self.history[reading.sensor_id] = deque(maxlen=self.moving_window)
+            self.moments[reading.sensor_id] = [0.0, 0.0]
             
         history = self.history[reading.sensor_id]
-        history.append(reading.value)
-        
-        if len(history) > self.moving_window:
-            history.pop(0)
+        moments = self.moments[reading.sensor_id]
+        if len(history) == self.moving_window:
+            evicted = history[0]
+            moments[0] -= evicted
+            moments[1] -= evicted * evicted
+        history.append(value)
+        moments[0] += value
+        moments[1] += value * value
             
         # Statistical validation
-        if len(history) >= 3:
-            z_score = stats.zscore(history)[-1]
+        n = len(history)
+        if n >= 3:
+            mean = moments[0] / n
+            var = moments[1] / n - mean * mean
+            z_score = (value - mean) / np.sqrt(var) if var > 0 else 0.0
             if abs(z_score) > self.z_score_threshold:
                 return False, f"Z-score {z_score:.2f} exceeds threshold"
         
@@ -55,7 +81,8 @@ class SensorDataProcessor:
             'min_quality_score': 0.7
         })
         self.logger = logging.getLogger('SensorDataProcessor')
-        self.data_buffer: Dict[str, List[SensorReading]] = {}
+        self.batch_size = 10
+        self.data_buffer: Dict[str, RingSoA] = {}
         
     async def process_reading(self, reading: SensorReading) -> Optional[Dict]:
         """Process and validate a single sensor reading."""
@@ -69,13 +96,17 @@ class SensorDataProcessor:
                 
             # Store in buffer
             if reading.sensor_id not in self.data_buffer:
-                self.data_buffer[reading.sensor_id] = []
-            self.data_buffer[reading.sensor_id].append(reading)
+                self.data_buffer[reading.sensor_id] = RingSoA(self.batch_size)
+            buffer = self.data_buffer[reading.sensor_id]
+            buffer.values[buffer.idx] = reading.value
+            buffer.ts[buffer.idx] = reading.timestamp
+            buffer.q[buffer.idx] = reading.quality_score
+            buffer.idx += 1
             
             # Process buffer if enough readings
-            if len(self.data_buffer[reading.sensor_id]) >= 10:
+            if buffer.idx >= self.batch_size:
                 processed_data = await self._process_buffer(reading.sensor_id)
-                self.data_buffer[reading.sensor_id] = []
+                buffer.idx = 0
                 return processed_data
                 
             return None
@@ -86,21 +117,22 @@ class SensorDataProcessor:
             
     async def _process_buffer(self, sensor_id: str) -> Dict:
         """Process buffered readings for a sensor."""
-        readings = self.data_buffer[sensor_id]
+        buffer = self.data_buffer[sensor_id]
+        n = buffer.idx
         
-        # Calculate statistics
-        values = [r.value for r in readings]
-        timestamps = [r.timestamp for r in readings]
+        # Calculate statistics in a single jitted pass
+        mean, std, min_value, max_value = stats4(buffer.values[:n])
         
+        # Readings arrive in order, so the ends of the slice bound the batch
         return {
             'sensor_id': sensor_id,
-            'timestamp_start': min(timestamps),
-            'timestamp_end': max(timestamps),
-            'mean': np.mean(values),
-            'std': np.std(values),
-            'min': min(values),
-            'max': max(values),
-            'reading_count': len(readings)
+            'timestamp_start': buffer.ts[0],
+            'timestamp_end': buffer.ts[n - 1],
+            'mean': mean,
+            'std': std,
+            'min': min_value,
+            'max': max_value,
+            'reading_count': n
         }
 
 class SensorTestHarness:
@@ -109,6 +141,7 @@ class SensorTestHarness:
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.processor = SensorDataProcessor()
+        self.logger = logging.getLogger('SensorTestHarness')
         self.broker_address = broker_address
         self.port = port
         
@@ -119,7 +152,7 @@ class SensorTestHarness:
         
     async def _on_message(self, client, userdata, msg):
         try:
-            payload = json.loads(msg.payload)
+            payload = orjson.loads(msg.payload)
             reading = SensorReading(
                 timestamp=payload['timestamp'],
                 value=payload['value'],
@@ -132,23 +165,26 @@ class SensorTestHarness:
             if processed_data:
                 await self._handle_processed_data(processed_data)
                 
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             self.logger.error(f"Invalid JSON payload: {msg.payload}")
         except Exception as e:
             self.logger.error(f"Error processing message: {str(e)}")
             
     async def _handle_processed_data(self, data: Dict):
         """Handle processed sensor data."""
-        # Log processed data
-        self.logger.info(f"Processed data: {json.dumps(data, indent=2)}")
+        # Serialize once and share the result with every sink
+        blob = orjson.dumps(data)
+        self.logger.info("Processed data: %s", blob.decode())
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(orjson.dumps(data, option=orjson.OPT_INDENT_2).decode())
         
         # Simulate blockchain logging
-        await self._log_to_blockchain(data)
+        await self._log_to_blockchain(blob)
         
-    async def _log_to_blockchain(self, data: Dict):
+    async def _log_to_blockchain(self, blob: bytes):
         """Simulate blockchain logging for testing."""
         # This would be replaced with actual blockchain implementation
-        self.logger.info(f"Logging to blockchain: {json.dumps(data, indent=2)}")
+        self.logger.info("Logging to blockchain: %s", blob.decode())
         
     async def run_test(self, duration_seconds: int):
         """Run test harness for specified duration."""
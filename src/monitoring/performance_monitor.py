@@ -7,78 +7,146 @@ Created: 2025-02-07
 """
 import asyncio
 import time
-from collections import deque
 import numpy as np
 from datetime import datetime
 import logging
-import json
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+import orjson
+
+_log_listener: Optional[QueueListener] = None
+
+def _setup_monitor_logging():
+    """Give the 'PerformanceMonitor' logger a queue-backed file handler, once per process.
+
+    Only this logger is touched; root logging is left to the host process.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return
+    logger = logging.getLogger('PerformanceMonitor')
+    file_handler = logging.FileHandler(f'performance_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    _log_listener = QueueListener(log_queue, file_handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+class MetricRing:
+    """Fixed-size circular buffer of (timestamp, value) samples."""
+    def __init__(self, capacity=1000):
+        self.cap = capacity
+        self.ts = np.empty(capacity, dtype=np.float64)
+        self.vals = np.empty(capacity, dtype=np.float64)
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp, value):
+        self.ts[self.head] = timestamp
+        self.vals[self.head] = value
+        self.head = (self.head + 1) % self.cap
+        if self.count < self.cap:
+            self.count += 1
+
+    def since(self, start):
+        """Values recorded at or after start, oldest first."""
+        # Timestamps are appended in order, so each segment is sorted
+        if self.count < self.cap or self.head == 0:
+            lo = np.searchsorted(self.ts[:self.count], start)
+            return self.vals[lo:self.count]
+        if start > self.ts[0]:
+            lo = np.searchsorted(self.ts[:self.head], start)
+            return self.vals[lo:self.head]
+        lo = self.head + np.searchsorted(self.ts[self.head:], start)
+        return np.concatenate((self.vals[lo:], self.vals[:self.head]))
 
 class PerformanceMonitor:
     def __init__(self):
-        self.buffer_sizes = deque(maxlen=1000)
-        self.processing_times = deque(maxlen=1000)
-        self.error_counts = deque(maxlen=1000)
-        self.anomaly_counts = deque(maxlen=1000)
+        self.buffer_sizes = MetricRing(1000)
+        self.processing_times = MetricRing(1000)
+        self.error_counts = MetricRing(1000)
+        self.anomaly_counts = MetricRing(1000)
         self.last_alert = None
         self.alert_cooldown = 5  # seconds
+        self.tick_interval = 1  # seconds
+        self.loop = None
+        self._handle = None
         
         # Configure logging
         self.logger = logging.getLogger('PerformanceMonitor')
-        handler = logging.FileHandler(f'performance_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log')
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(handler)
-        self.logger.setLevel(logging.INFO)
-
-    async def start_monitoring(self):
-        while True:
-            try:
-                stats = self.get_current_stats()
-                self.check_thresholds(stats)
-                self.log_stats(stats)
-                await asyncio.sleep(1)
-            except Exception as e:
-                self.logger.error(f"Error in monitoring loop: {e}")
+        _setup_monitor_logging()
+
+    def start_monitoring(self, loop=None):
+        """Schedule the periodic monitor tick on the given (or running) event loop."""
+        self.loop = loop or asyncio.get_running_loop()
+        self._tick()
+
+    def stop_monitoring(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick(self):
+        try:
+            # Read the clock once per tick and share it
+            now = time.time()
+            stats = self.get_current_stats(now)
+            self.check_thresholds(stats, now)
+            self.log_stats(stats)
+        except Exception as e:
+            self.logger.error(f"Error in monitoring loop: {e}")
+        finally:
+            self._handle = self.loop.call_later(self.tick_interval, self._tick)
 
     def add_metric(self, metric_type, value):
         timestamp = time.time()
         if metric_type == 'buffer_size':
-            self.buffer_sizes.append((timestamp, value))
+            self.buffer_sizes.append(timestamp, value)
         elif metric_type == 'processing_time':
-            self.processing_times.append((timestamp, value))
+            self.processing_times.append(timestamp, value)
         elif metric_type == 'error_count':
-            self.error_counts.append((timestamp, value))
+            self.error_counts.append(timestamp, value)
         elif metric_type == 'anomaly_count':
-            self.anomaly_counts.append((timestamp, value))
+            self.anomaly_counts.append(timestamp, value)
 
-    def get_current_stats(self):
-        now = time.time()
+    def get_current_stats(self, now=None):
+        if now is None:
+            now = time.time()
         window = 10  # 10 second window for calculations
         
         # Filter metrics within window
-        recent_buffer = [(t, v) for t, v in self.buffer_sizes if now - t <= window]
-        recent_processing = [(t, v) for t, v in self.processing_times if now - t <= window]
-        recent_errors = [(t, v) for t, v in self.error_counts if now - t <= window]
-        recent_anomalies = [(t, v) for t, v in self.anomaly_counts if now - t <= window]
+        start = now - window
+        recent_buffer = self.buffer_sizes.since(start)
+        recent_processing = self.processing_times.since(start)
+        recent_errors = self.error_counts.since(start)
+        recent_anomalies = self.anomaly_counts.since(start)
 
         return {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': datetime.fromtimestamp(now).isoformat(),
             'buffer_size': {
-                'current': recent_buffer[-1][1] if recent_buffer else 0,
-                'max': max([v for _, v in recent_buffer]) if recent_buffer else 0,
-                'avg': np.mean([v for _, v in recent_buffer]) if recent_buffer else 0
+                # Buffer sizes are counts; keep them integral despite the float64 ring
+                'current': int(recent_buffer[-1]) if recent_buffer.size else 0,
+                'max': int(recent_buffer.max()) if recent_buffer.size else 0,
+                'avg': recent_buffer.mean() if recent_buffer.size else 0
             },
             'processing_time': {
-                'current': recent_processing[-1][1] if recent_processing else 0,
-                'max': max([v for _, v in recent_processing]) if recent_processing else 0,
-                'avg': np.mean([v for _, v in recent_processing]) if recent_processing else 0,
-                'p95': np.percentile([v for _, v in recent_processing], 95) if recent_processing else 0
+                'current': recent_processing[-1] if recent_processing.size else 0,
+                'max': recent_processing.max() if recent_processing.size else 0,
+                'avg': recent_processing.mean() if recent_processing.size else 0,
+                'p95': np.percentile(recent_processing, 95) if recent_processing.size else 0
             },
-            'error_rate': len(recent_errors) / window if recent_errors else 0,
-            'anomaly_rate': len(recent_anomalies) / window if recent_anomalies else 0
+            'error_rate': recent_errors.size / window,
+            'anomaly_rate': recent_anomalies.size / window
         }
 
-    def check_thresholds(self, stats):
-        now = time.time()
+    def check_thresholds(self, stats, now=None):
+        if now is None:
+            now = time.time()
         
         # Only alert if cooldown period has passed
         if self.last_alert and now - self.last_alert < self.alert_cooldown:
@@ -105,7 +173,7 @@ class PerformanceMonitor:
             print(f"\033[91mALERT: {alert_msg}\033[0m")  # Red color in terminal
 
     def log_stats(self, stats):
-        self.logger.info(json.dumps(stats))
+        self.logger.info(orjson.dumps(stats, option=orjson.OPT_SERIALIZE_NUMPY).decode())
         
         # Print summary to console
         print(f"\033[94m=== Performance Summary ===\033[0m")  # Blue color
@@ -117,7 +185,12 @@ class PerformanceMonitor:
 
 async def main():
     monitor = PerformanceMonitor()
-    await monitor.start_monitoring()
+    monitor.start_monitoring()
+    try:
+        # Keep the loop alive; the monitor runs from timer callbacks
+        await asyncio.get_running_loop().create_future()
+    finally:
+        monitor.stop_monitoring()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -6,13 +6,25 @@ Author: [natefrog]
 Created: 2025-02-07
 """
 import asyncio
-import json
-import random
+import orjson
 import time
-from datetime import datetime
 import paho.mqtt.client as mqtt
 import numpy as np
 
+MESSAGE_TYPES = [
+    "normal",
+    "anomaly",
+    "noise",
+    "missing_data",
+    "corrupt_data",
+    "burst"  # Added burst type
+]
+MESSAGE_PROBS = [0.5, 0.15, 0.15, 0.1, 0.05, 0.05]  # Adjusted probabilities
+
+# Random draws are made in pools to amortize the per-call NumPy overhead
+_RNG = np.random.default_rng()
+_POOL_SIZE = 4096
+
 class LoadTestGenerator:
     def __init__(self, broker="localhost", port=1883):
         self.client = mqtt.Client()
@@ -21,6 +33,39 @@ class LoadTestGenerator:
         self.running = False
         self.base_flow_rate = 50.0
         self.noise_factor = 0.1
+        # Scalar draws come from list pools so indexing yields Python floats
+        self._normal_pool = _RNG.standard_normal(_POOL_SIZE).tolist()
+        self._normal_idx = 0
+        self._uniform_pool = _RNG.random(_POOL_SIZE).tolist()
+        self._uniform_idx = 0
+        self._type_pool = _RNG.choice(len(MESSAGE_TYPES), size=_POOL_SIZE, p=MESSAGE_PROBS)
+        self._type_idx = 0
+        
+    def _next_normal(self) -> float:
+        """Next standard normal draw from the pool."""
+        if self._normal_idx == _POOL_SIZE:
+            self._normal_pool = _RNG.standard_normal(_POOL_SIZE).tolist()
+            self._normal_idx = 0
+        z = self._normal_pool[self._normal_idx]
+        self._normal_idx += 1
+        return z
+
+    def _uniform(self, low: float, high: float) -> float:
+        """Next uniform draw from [low, high) taken from the pool."""
+        if self._uniform_idx == _POOL_SIZE:
+            self._uniform_pool = _RNG.random(_POOL_SIZE).tolist()
+            self._uniform_idx = 0
+        u = self._uniform_pool[self._uniform_idx]
+        self._uniform_idx += 1
+        return low + (high - low) * u
+
+    def _next_message_type(self) -> str:
+        if self._type_idx == _POOL_SIZE:
+            self._type_pool = _RNG.choice(len(MESSAGE_TYPES), size=_POOL_SIZE, p=MESSAGE_PROBS)
+            self._type_idx = 0
+        message_type = MESSAGE_TYPES[self._type_pool[self._type_idx]]
+        self._type_idx += 1
+        return message_type
         
     async def start(self, duration_seconds: int = 300):
         """Run load test for specified duration"""
@@ -44,65 +89,73 @@ class LoadTestGenerator:
             
     async def _generate_test_data(self):
         """Generate test data with various patterns"""
-        timestamp = datetime.utcnow().isoformat() + "Z"
+        # Unix epoch nanoseconds; batched records are spaced 100us apart
+        timestamp = time.time_ns()
         
         # More aggressive test pattern
-        message_type = np.random.choice([
-            "normal",
-            "anomaly",
-            "noise",
-            "missing_data",
-            "corrupt_data",
-            "burst"  # Added burst type
-        ], p=[0.5, 0.15, 0.15, 0.1, 0.05, 0.05])  # Adjusted probabilities
+        message_type = self._next_message_type()
         
         # Simulate periodic data bursts
         if message_type == "burst":
-            # Generate burst of 50 messages in quick succession
-            for _ in range(50):
-                burst_value = self.base_flow_rate * random.uniform(0.5, 1.5)
-                burst_message = {
-                    "timestamp": datetime.utcnow().isoformat() + "Z",
+            # Generate burst of 50 messages published as a single batch
+            # A whole burst is already a batch, so draw it directly
+            u = _RNG.random(100)
+            burst_values = (self.base_flow_rate * (0.5 + u[:50])).tolist()
+            burst_scores = (0.7 + 0.2 * u[50:]).tolist()
+            burst_messages = [
+                {
+                    "timestamp": timestamp + i * 100_000,
                     "value": burst_value,
-                    "quality_score": random.uniform(0.7, 0.9),
+                    "quality_score": burst_score,
                     "sensor_id": "water_meter_001",
                     "type": "burst"
                 }
-                self.client.publish(
-                    "sensor/water_meter_001/data",
-                    json.dumps(burst_message),
-                    qos=1
-                )
+                for i, (burst_value, burst_score) in enumerate(zip(burst_values, burst_scores))
+            ]
+            self.client.publish(
+                "sensor/water_meter_001/data_batch",
+                orjson.dumps(burst_messages),
+                qos=1
+            )
+            print(f"Published burst of {len(burst_messages)} messages")
+            return
         
         if message_type == "normal":
-            value = self.base_flow_rate + np.random.normal(0, self.noise_factor * self.base_flow_rate)
-            quality_score = random.uniform(0.8, 1.0)
+            value = self.base_flow_rate + self.noise_factor * self.base_flow_rate * self._next_normal()
+            quality_score = self._uniform(0.8, 1.0)
             
         elif message_type == "anomaly":
             # Generate significant deviation
             # More extreme anomalies
-            value = self.base_flow_rate * random.uniform(8, 15)  # Increased range
+            value = self.base_flow_rate * self._uniform(8, 15)  # Increased range
             # Occasionally inject rapid anomaly sequences
-            if random.random() < 0.2:  # 20% chance of anomaly sequence
-                for _ in range(5):
-                    spike_value = self.base_flow_rate * random.uniform(5, 20)
-                    self.client.publish(
-                        "sensor/water_meter_001/data",
-                        json.dumps({
-                            "timestamp": datetime.utcnow().isoformat() + "Z",
-                            "value": spike_value,
-                            "quality_score": random.uniform(0.8, 1.0),
-                            "sensor_id": "water_meter_001",
-                            "type": "anomaly_sequence"
-                        }),
-                        qos=1
-                    )
-            quality_score = random.uniform(0.8, 1.0)
+            if self._uniform(0, 1) < 0.2:  # 20% chance of anomaly sequence
+                u = _RNG.random(10)
+                spike_values = (self.base_flow_rate * (5 + 15 * u[:5])).tolist()
+                spike_scores = (0.8 + 0.2 * u[5:]).tolist()
+                spike_messages = [
+                    {
+                        "timestamp": timestamp + i * 100_000,
+                        "value": spike_value,
+                        "quality_score": spike_score,
+                        "sensor_id": "water_meter_001",
+                        "type": "anomaly_sequence"
+                    }
+                    for i, (spike_value, spike_score) in enumerate(zip(spike_values, spike_scores))
+                ]
+                self.client.publish(
+                    "sensor/water_meter_001/data_batch",
+                    orjson.dumps(spike_messages),
+                    qos=1
+                )
+                print(f"Published anomaly sequence of {len(spike_messages)} messages")
+                return
+            quality_score = self._uniform(0.8, 1.0)
             
         elif message_type == "noise":
             # Generate noisy but valid data
-            value = self.base_flow_rate + np.random.normal(0, self.base_flow_rate)
-            quality_score = random.uniform(0.6, 0.8)
+            value = self.base_flow_rate + self.base_flow_rate * self._next_normal()
+            quality_score = self._uniform(0.6, 0.8)
             
         elif message_type == "missing_data":
             value = None
@@ -110,7 +163,7 @@ class LoadTestGenerator:
             
         else:  # corrupt_data
             value = "invalid_value"
-            quality_score = random.uniform(0, 0.5)
+            quality_score = self._uniform(0, 0.5)
             
         message = {
             "timestamp": timestamp,
@@ -121,12 +174,13 @@ class LoadTestGenerator:
         }
         
         try:
+            data = orjson.dumps(message)
             self.client.publish(
                 "sensor/water_meter_001/data",
-                json.dumps(message),
+                data,
                 qos=1
             )
-            print(f"Published {message_type} message: {json.dumps(message)}")
+            print(f"Published {message_type} message: {data.decode()}")
             
         except Exception as e:
             print(f"Error publishing message: {e}")